@@ -1,7 +1,7 @@
 import os
 import sys
 import json
-import boto3
+import orjson
 import asyncio
 # Add both potential python paths
 sys.path.append("/opt/python")
@@ -16,15 +16,14 @@ except ImportError as e:
 
 os.environ['PATH'] = f"/opt/ffmpeg/bin:{os.environ['PATH']}"
 # Set CPU configurations
-os.environ['TORCH_DEVICE'] = 'cpu'
 os.environ['TRANSFORMERS_OFFLINE'] = '1'
-
-import torch
-torch.set_default_tensor_type('torch.FloatTensor')
-from services import validate_audio_file, process_audio_file
-
-s3_client = boto3.client('s3')
-bedrock_runtime = boto3.client('bedrock-runtime')
+# Pin BLAS/OpenMP thread pools to the vCPU count before the inference
+# backend loads, otherwise they oversubscribe Lambda's small core count
+os.environ['OMP_NUM_THREADS'] = str(os.cpu_count())
+os.environ['MKL_NUM_THREADS'] = str(os.cpu_count())
+# Reuse the pooled clients built in services.py so both modules share one
+# warm connection pool per container
+from services import validate_audio_file, process_audio_file, flush_pending_uploads, s3_client, bedrock_runtime
 
 os.environ['INFERENCE_PROFILE_ARN'] = "arn:aws:bedrock:us-east-1:010526276239:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0"
 INFERENCE_PROFILE_ARN = os.environ.get('INFERENCE_PROFILE_ARN')
@@ -68,14 +67,16 @@ async def qa_with_claude(transcript_text, question):
             "top_p": 0.9
         }
 
-        response = bedrock_runtime.invoke_model(
+        # Blocking boto3 call runs in a worker thread to keep the loop free
+        response = await asyncio.to_thread(
+            bedrock_runtime.invoke_model,
             modelId=INFERENCE_PROFILE_ARN,
-            body=json.dumps(body),
+            body=orjson.dumps(body),
             contentType='application/json',
             accept='application/json'
         )
 
-        response_body = json.loads(response['body'].read())
+        response_body = orjson.loads(response['body'].read())
         answer = response_body['content'][0]['text']
 
         return answer
@@ -90,8 +91,8 @@ async def get_transcript_from_s3(s3_client, bucket, key):
     """
     try:
         print(f"Attempting to retrieve transcript from bucket: {bucket}, key: {key}")
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read().decode('utf-8')
+        response = await asyncio.to_thread(s3_client.get_object, Bucket=bucket, Key=key)
+        content = (await asyncio.to_thread(response['Body'].read)).decode('utf-8')
         transcript_data = json.loads(content)
         
         # Try to get transcript from different possible keys
@@ -127,49 +128,89 @@ async def lambda_handler(event, context):
                     })
                 }
             
-            record = records[0]
-            bucket = record['s3']['bucket']['name']
-            key = record['s3']['object']['key']
-            filename = key.split('/')[-1]
+            # Validate every record up front; events can batch several uploads
+            targets = []
+            for record in records:
+                bucket = record['s3']['bucket']['name']
+                key = record['s3']['object']['key']
+                filename = key.split('/')[-1]
 
-            # Validate the audio file
-            if not validate_audio_file(key):
-                return {
-                    'statusCode': 400,
-                    'body': json.dumps({
-                        'error': 'Invalid file type or location. Please upload audio files to the audio/ folder.'
-                    })
-                }
+                if not validate_audio_file(key):
+                    return {
+                        'statusCode': 400,
+                        'body': json.dumps({
+                            'error': f'Invalid file type or location: {key}. Please upload audio files to the audio/ folder.'
+                        })
+                    }
+                targets.append((bucket, key, filename))
 
-            result = await process_audio_file(s3_client, bucket, key, filename)
-            return {
-                'statusCode': 200,
-                'body': json.dumps(result)
-            }
+            try:
+                # Process the batch concurrently so S3/Bedrock waits overlap.
+                # return_exceptions keeps one bad record from cancelling its
+                # siblings mid-flight and discarding their finished work
+                outcomes = await asyncio.gather(*[
+                    process_audio_file(s3_client, bucket, key, filename)
+                    for bucket, key, filename in targets
+                ], return_exceptions=True)
+
+                results = []
+                failed_count = 0
+                for (bucket, key, filename), outcome in zip(targets, outcomes):
+                    if isinstance(outcome, Exception):
+                        print(f"Error processing {key}: {str(outcome)}")
+                        failed_count += 1
+                        results.append({'key': key, 'error': str(outcome)})
+                    else:
+                        results.append(outcome)
+
+                response = {
+                    # Failures are reported per record; only a fully failed
+                    # batch turns into a 500
+                    'statusCode': 500 if failed_count == len(targets) else 200,
+                    'body': json.dumps(results[0] if len(results) == 1 else results)
+                }
+            except Exception as e:
+                # Logged here because a flush failure raised from the
+                # finally below would replace this exception
+                print(f"Error processing transcription batch: {str(e)}")
+                raise
+            finally:
+                # Drain background PUTs even when a record failed, so the
+                # transcripts of records that did succeed still land before
+                # the loop is torn down
+                await flush_pending_uploads()
+            return response
             
         elif operation == 'q_n_a':
             # Handle Q&A operation
             transcript_file = event.get('transcript_file')
             transcript_bucket = event.get('transcript_bucket')
+            transcript_text = event.get('transcript_text')
             question = event.get('question')
-            
-            # Validate required parameters
-            if not all([transcript_file, transcript_bucket, question]):
+
+            # Validate required parameters: the transcript comes either
+            # inline (e.g. passed forward by Step Functions from the
+            # transcribe output) or as an S3 location
+            if not question or not (transcript_text or (transcript_file and transcript_bucket)):
                 return {
                     'statusCode': 400,
                     'body': json.dumps({
-                        'error': 'Missing required parameters: transcript_file, transcript_bucket, and question'
+                        'error': 'Missing required parameters: question plus either transcript_text or transcript_file and transcript_bucket'
                     })
                 }
-            
+
             try:
-                # Retrieve transcript from S3
-                transcript = await get_transcript_from_s3(
-                    s3_client, 
-                    transcript_bucket, 
-                    transcript_file
-                )
-                
+                if transcript_text:
+                    # Inline transcript skips the S3 GET and JSON parse
+                    transcript = transcript_text
+                else:
+                    # Retrieve transcript from S3
+                    transcript = await get_transcript_from_s3(
+                        s3_client,
+                        transcript_bucket,
+                        transcript_file
+                    )
+
                 if not transcript:
                     return {
                         'statusCode': 404,